@@ -61,12 +61,7 @@ class Worker(object):
 
         self.wamp = WampBase(self.conn)
         self.wamp.connect(self.conf.get_wamp_url(), self.conf.get_wamp_realm())
-
-        s = time.time()
-        while not self.wamp.session.is_attached():
-            if time.time() - s > 5:
-                raise RuntimeError("Cannot attach to WAMP session")
-            time.sleep(0.1)
+        self.wamp.wait_attached(5)
 
         print("session attached")
         f = open(self.path, "wb", buffering=2048)
@@ -77,7 +72,7 @@ class Worker(object):
         print("prima fut")
         (_, self.outpipe) = fut.result()
 
-        self.wamp.subscribe(self.recv, self.conf.get_wamp_pol(self.pol))
+        self.wamp.subscribe_sync(self.recv, self.conf.get_wamp_pol(self.pol))
         self.wamp.th.join()
 
     def recv(self, *args, **pkt):
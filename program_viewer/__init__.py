@@ -9,6 +9,8 @@ import numpy as np
 import time
 import astropy.time as at
 import datetime as dt
+import functools
+import warnings
 from program_viewer.ui.main_window import Ui_MainWindow
 from web.rest.base import Connection
 from widgets.login import LoginWidget
@@ -16,23 +18,6 @@ from config import Config
 import os
 
 
-class CheckBoxCallBack(object):
-    """CheckBox callback container"""
-
-    def __init__(self, plot, table, hk):
-        self.plot = plot
-        self.table = table
-        self.hk = hk
-
-    def callback(self, val):
-        """called when the registred checkbox changes status"""
-        # print(self.hk,val)
-        if val == 0:
-            self.plot.del_plot(self.table, self.hk)
-        elif val == 2:
-            self.plot.add_plot(self.table, self.hk)
-
-
 class ApplicationWindow(QtWidgets.QMainWindow):
     """Main window class"""
 
@@ -53,12 +38,10 @@ class ApplicationWindow(QtWidgets.QMainWindow):
 
         conf = Config()
         conf.load(self.conn)
-        self.callbacks = []
+        pol_tables = [x for x in conf.board_addr if x.endswith("POL")]
 
         t = self.ui.hk_table
-        t.setRowCount(
-            sum([len(conf.board_addr[x]) for x in conf.board_addr if x.endswith("POL")])
-        )
+        t.setRowCount(sum([len(conf.board_addr[x]) for x in pol_tables]))
         t.setColumnCount(3)
         i = 0
         #        for s in SCI:
@@ -71,22 +54,19 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         #            t.setCellWidget(i,0,cb)
         #            i += 1
 
-        for table in conf.board_addr:
-            if not table.endswith("POL"):
-                continue
+        for table in pol_tables:
             for hk in conf.board_addr[table]:
+                name = hk["name"]
                 cb = QtWidgets.QCheckBox(t)
-                # cb.setText(hk['name'])
-                callb = CheckBoxCallBack(self.ui.plot, table, hk["name"])
-                cb.stateChanged.connect(callb.callback)
-                self.callbacks.append((cb, callb))
+                # cb.setText(name)
+                cb.stateChanged.connect(functools.partial(self.hkToggled, table, name))
 
                 item_table = QtWidgets.QTableWidgetItem()
                 item_table.setText(table)
                 t.setItem(i, 1, item_table)
 
                 item_hk = QtWidgets.QTableWidgetItem()
-                item_hk.setText(hk["name"])
+                item_hk.setText(name)
                 t.setItem(i, 2, item_hk)
 
                 t.setCellWidget(i, 0, cb)
@@ -100,23 +80,29 @@ class ApplicationWindow(QtWidgets.QMainWindow):
 
         self.ui.plot.start(self.conn, self.ui.polList.currentText())
 
+    def hkToggled(self, table, hk, val):
+        """callback for the housekeeping checkboxes, shared by all of them.
+        adds or removes the (table, hk) line from the plot.
+        """
+        if val == 0:
+            self.ui.plot.del_plot(table, hk)
+        elif val == 2:
+            self.ui.plot.add_plot(table, hk)
+
     def polChanged(self, i):
         """callback for polarimer change on the dropdown list.
-        stops the current polatimeter streaming and starts a new streaming
-        for the selected polarimeter.
+        moves the plot subscription from the current polatimeter stream to
+        the one of the selected polarimeter, on the same WAMP session (or on
+        a new one, if the connection was lost).
         """
-        pol = self.ui.polList.currentText()
-        hkdict = {}
-        for cb, call in self.callbacks:
-            if cb.checkState() == 2:
-                if hkdict.get(call.table) is None:
-                    hkdict[call.table] = set()
-                hkdict[call.table].add(call.hk)
-
-        print(hkdict)
-
-        self.ui.plot.stop()
-        self.ui.plot.start(self.conn, pol, items=hkdict)
+        try:
+            self.ui.plot.set_pol(self.ui.polList.currentText())
+        except RuntimeError as e:
+            warnings.warn(str(e), RuntimeWarning)
+            # show the polarimeter the plot is actually bound to
+            self.ui.polList.blockSignals(True)
+            self.ui.polList.setCurrentText(self.ui.plot.pol)
+            self.ui.polList.blockSignals(False)
 
     def stop(self):
         self.ui.plot.stop()
@@ -102,7 +102,7 @@ def get_lna_num(name):
     if type(name) is int or name in ["4A", "5A"]:
         # Assume that the index refers to the proper firmware register
         return name
-    elif (len(name) == 3) and (name[0:2] in ["HA", "HB"]):
+    elif (len(name) == 3) and name.startswith(("HA", "HB")):
         # Official names
         d = {
             "HA1": 0,
@@ -203,7 +203,7 @@ def scan_board_names(group_names: List[str]) -> Set[str]:
     """
     result = set()  # type: Set[str]
     for curname in group_names:
-        if (len(curname) == 7) and (curname[0:6] == "BOARD_"):
+        if (len(curname) == 7) and curname.startswith("BOARD_"):
             result.add(curname[6].upper())
 
     return result
@@ -219,7 +219,7 @@ def scan_polarimeter_names(group_names: List[str]) -> Set[str]:
     """
     result = set()  # type: Set[str]
     for curname in group_names:
-        if (len(curname) == 6) and (curname[0:4] == "POL_"):
+        if (len(curname) == 6) and curname.startswith("POL_"):
             result.add(curname[4:6].upper())
 
     return result
@@ -0,0 +1,91 @@
+# -*- encoding: utf-8 -*-
+
+from collections import deque
+
+import numpy as np
+import pytest
+
+from widgets.plot.pol import SampleBuffer
+
+# One second, expressed in days (the unit of MJD timestamps)
+SEC = 1.0 / 86400
+
+
+def reference(samples, wsec):
+    """Keep the (ts, val) samples not older than `wsec` from the last one"""
+    window = deque()
+    for ts, val in samples:
+        window.append((ts, val))
+        while (ts - window[0][0]) * 86400 > wsec:
+            window.popleft()
+    return window
+
+
+def check(buf, window):
+    ts, val = buf.get()
+    assert len(buf) == len(window)
+    assert np.array_equal(ts, [x[0] for x in window])
+    assert np.array_equal(val, [x[1] for x in window])
+
+
+def test_sample_buffer_wrap_around():
+    # 4 samples in the window: once full, each append overwrites the oldest
+    buf = SampleBuffer(window_sec=3.5, capacity=4)
+    samples = [(58000 + i * SEC, float(i)) for i in range(11)]
+    for i, (ts, val) in enumerate(samples):
+        buf.append(ts, val)
+        check(buf, reference(samples[: i + 1], 3.5))
+
+    assert buf.ts.size == 4
+    assert buf.head == 11 % 4
+
+
+def test_sample_buffer_grow_with_head_in_the_middle():
+    buf = SampleBuffer(window_sec=2.5, capacity=4)
+    samples = [(58000 + i * SEC, float(i)) for i in range(6)]
+    for ts, val in samples:
+        buf.append(ts, val)
+
+    # The ring has wrapped, so its head is in the middle of the array. The next
+    # two samples are too close to evict anything: the second one must grow it
+    assert buf.head == 2
+    assert len(buf) == 3
+    samples += [(samples[-1][0] + 0.1 * SEC, 6.0), (samples[-1][0] + 0.2 * SEC, 7.0)]
+    for ts, val in samples[6:]:
+        buf.append(ts, val)
+
+    assert buf.ts.size == 8
+    check(buf, reference(samples, 2.5))
+
+
+def test_sample_buffer_eviction_at_window_edge():
+    t0, t1, t2 = 58000.0, 58000.0 + SEC, 58000.0 + 2 * SEC
+    # Use the very same expression as SampleBuffer, so that the age of the
+    # first sample is exactly the window length when the third one arrives
+    buf = SampleBuffer(window_sec=(t2 - t0) * 86400, capacity=8)
+    buf.append(t0, 0.0)
+    buf.append(t1, 1.0)
+
+    # A sample exactly `wsec` older than the newest one is kept...
+    buf.append(t2, 2.0)
+    assert list(buf.get()[1]) == [0.0, 1.0, 2.0]
+
+    # ...and evicted as soon as it falls outside the window
+    buf.append(t2 + 0.5 * SEC, 3.0)
+    assert list(buf.get()[1]) == [1.0, 2.0, 3.0]
+
+
+def test_sample_buffer_randomized():
+    rng = np.random.default_rng(1)
+    for capacity in [1, 2, 4, 8]:
+        buf = SampleBuffer(window_sec=5.0, capacity=capacity)
+        ts = 58000 + np.cumsum(rng.uniform(0, 2, size=500)) * SEC
+        samples = [(t, float(i)) for i, t in enumerate(ts)]
+        for i, (t, val) in enumerate(samples):
+            buf.append(t, val)
+            check(buf, reference(samples[: i + 1], 5.0))
+
+
+def test_sample_buffer_invalid_capacity():
+    with pytest.raises(ValueError):
+        SampleBuffer(window_sec=1.0, capacity=0)
@@ -4,9 +4,11 @@
 import websockets
 import json
 import asyncio
+import concurrent.futures
 from web.rest.base import Connection
 from autobahn.asyncio.wamp import ApplicationSession, ApplicationRunner
-from threading import Thread
+from autobahn.wamp.exception import ApplicationError
+from threading import Thread, Event, current_thread
 
 
 class WampBase(object):
@@ -20,6 +22,7 @@ class WampBase(object):
         self.loop = None
         self.session = None
         self.th = None
+        self.attached = Event()
 
     def connect(self, url, realm):
         """connect to websocket
@@ -36,27 +39,115 @@ class WampBase(object):
             realm=realm,
             headers={"cookie": "sessionid=%s" % self.conn.id},
         )
-        self.loop = asyncio.get_event_loop()
+        loop = asyncio.get_event_loop()
         self.session = ApplicationSession()
+        self.attached.clear()
+        self.session.on("join", self.__on_join)
         coro = self.runner.run(self.session, start_loop=False)
-        (self.__transport, self.__protocol) = self.loop.run_until_complete(coro)
+        (self.__transport, self.__protocol) = loop.run_until_complete(coro)
+        # only expose the loop once it is about to run in self.th, so that
+        # stop() never acts on a loop whose connection failed
+        self.loop = loop
         self.th.start()
 
+    def wait_attached(self, timeout=5.0):
+        """blocks until the session has joined the WAMP realm
+        :param float timeout: the maximum number of seconds to wait
+        :raises RuntimeError: if the session does not join within timeout
+        """
+        if not self.attached.wait(timeout):
+            raise RuntimeError("Cannot attach to WAMP session")
+
     def subscribe(self, callback, topic):
         if self.session is None:
             raise RuntimeError("no Connection active")
         return self.session.subscribe(callback, topic)
 
+    def subscribe_sync(self, callback, topic, timeout=5.0):
+        """subscribes to a topic from any thread, waiting for the router to
+        acknowledge it.
+        :param callback: the function called for every event of the topic
+        :param str topic: the topic to subscribe to
+        :param float timeout: the maximum number of seconds to wait
+        :return: the autobahn Subscription
+        :raises RuntimeError: if the subscription fails or times out
+        """
+        if self.session is None:
+            raise RuntimeError("no Connection active")
+
+        requests = []
+
+        async def do_subscribe():
+            d = self.session.subscribe(callback, topic)
+            requests.append(d)
+            # shielded, so that giving up waiting does not cancel the request
+            return await asyncio.shield(d)
+
+        def drop_late(d):
+            if not d.cancelled() and d.exception() is None:
+                d.result().unsubscribe()
+
+        def on_timeout():
+            # the router can still acknowledge the request: nobody holds the
+            # handle of that subscription, so cancel it as soon as it arrives
+            for d in requests:
+                d.add_done_callback(drop_late)
+
+        return self.__run_sync(do_subscribe(), timeout, on_timeout)
+
+    def unsubscribe(self, sub, timeout=5.0):
+        """cancels a subscription, waiting for the router to acknowledge it.
+        No event for that subscription is dispatched after this returns.
+        :param sub: the Subscription returned by subscribe_sync()
+        :param float timeout: the maximum number of seconds to wait
+        :raises RuntimeError: if the unsubscription fails or times out
+        """
+        if not sub.active:
+            # autobahn detaches the handler before sending the request, so an
+            # earlier attempt that timed out has already stopped the events
+            return
+
+        async def do_unsubscribe():
+            await sub.unsubscribe()
+
+        self.__run_sync(do_unsubscribe(), timeout)
+
     def leave(self):
-        if self.session is not None:
+        self.attached.clear()
+        if self.session is not None and self.session.is_attached():
             self.session.leave()
-            self.stop()
+        self.stop()
 
     def stop(self):
+        """stops the event loop and waits for its thread to exit.
+        The loop is the thread's default one, so it is shared by every
+        WampBase created on that thread: it must be stopped before another
+        connect() can run it again.
+        """
         if self.loop is not None:
-            self.loop.stop()
+            if self.th is not None and self.th.is_alive():
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                if self.th is not current_thread():
+                    self.th.join()
             self.loop = None
 
+    def __run_sync(self, coro, timeout, on_timeout=None):
+        fut = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return fut.result(timeout)
+        except concurrent.futures.TimeoutError:
+            fut.cancel()
+            if on_timeout is not None:
+                self.loop.call_soon_threadsafe(on_timeout)
+            raise RuntimeError("WAMP router did not answer in time")
+        except ApplicationError as e:
+            raise RuntimeError("WAMP router error: %s" % e.error) from e
+        except Exception as e:
+            raise RuntimeError("WAMP request failed: %s" % e) from e
+
+    def __on_join(self, session, details):
+        self.attached.set()
+
     def __f(self):
         # asyncio.set_event_loop(self.loop)
         self.loop.run_forever()
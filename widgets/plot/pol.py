@@ -1,6 +1,7 @@
 # widgets/plot/pol.py --- Polarimeter plot classes
 #
 # Copyright (C) 2018 Stefano Sartor - stefano.sartor@inaf.it
+from PyQt5 import QtCore
 from widgets.plot import MplCanvas
 from web.wamp.base import WampBase
 from config import Config
@@ -8,12 +9,75 @@ import asyncio
 from threading import Thread
 import numpy as np
 import time
-import astropy.time as at
 import datetime as dt
 import time
 import gc
+import logging
 import matplotlib.pyplot as plt
 from copy import deepcopy
+from collections import deque
+
+MJD_EPOCH = dt.datetime(1858, 11, 17)
+
+
+class SampleBuffer(object):
+    """Time window of (mjd, value) samples stored in a preallocated ring.
+
+    Appending a sample is O(1): the oldest samples are evicted once they fall
+    outside the window, and the storage is only reallocated (doubling its
+    capacity) when the window holds more samples than it can fit.
+    """
+
+    def __init__(self, window_sec, capacity=1024):
+        """:param float window_sec: the time interval in seconds to retain
+        :param int capacity: the initial number of samples to preallocate
+        """
+        if capacity < 1:
+            raise ValueError(f"Invalid capacity {capacity}, it must be at least 1")
+
+        self.wsec = window_sec
+        self.ts = np.empty(capacity, dtype=np.float64)
+        self.val = np.empty(capacity, dtype=np.float64)
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, ts, val):
+        """add a sample, evicting the ones older than the time window
+        :param float ts: the sample timestamp (mjd)
+        :param float val: the sample value
+        """
+        size = self.ts.size
+        tail = (self.head - self.count) % size
+        while self.count > 0 and (ts - self.ts[tail]) * 86400 > self.wsec:
+            tail = (tail + 1) % size
+            self.count -= 1
+
+        if self.count == size:
+            self.__grow()
+            size = self.ts.size
+
+        self.ts[self.head] = ts
+        self.val[self.head] = val
+        self.head = (self.head + 1) % size
+        self.count += 1
+
+    def get(self):
+        """returns a copy of the (mjd, value) arrays, oldest sample first"""
+        size = self.ts.size
+        idx = (self.head - self.count + np.arange(self.count)) % size
+        return self.ts[idx], self.val[idx]
+
+    def __grow(self):
+        ts, val = self.get()
+        size = 2 * self.ts.size
+        self.ts = np.empty(size, dtype=np.float64)
+        self.val = np.empty(size, dtype=np.float64)
+        self.ts[: self.count] = ts
+        self.val[: self.count] = val
+        self.head = self.count
 
 
 class PolMplCanvas(MplCanvas):
@@ -25,6 +89,9 @@ class PolMplCanvas(MplCanvas):
         self.data = {}
         self.dict_add = {}
         self.dict_del = {}
+        self.queue = deque()
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.__refresh)
 
     def add_plot(self, table, hk):
         """add an housekeeping to the plot
@@ -68,45 +135,95 @@ class PolMplCanvas(MplCanvas):
                 self.items[t].add(hk)
 
         self.__prepare_canvas()
+        self.queue.clear()
+        self.sub = None
         self.sub = self.__connect()
+        self.timer.start(int(self.rsec * 1000))
 
     def stop(self):
         """Stops to listen to the data stream, closes websocket connection, stops the worker thread
         and clears the plot data.
         """
+        self.timer.stop()
         self.wamp.leave()
         self.wamp = None
+        self.queue.clear()
         self.__clear_data()
 
-    def replot(self):
-        self.wamp.loop.call_soon_threadsafe(self.__replot)
+    def set_pol(self, pol):
+        """switches the stream to another polarimeter, keeping the WAMP
+        session open and the housekeeping selection. The plot data is cleared.
+
+        If the WAMP session was lost, the plot is restarted with a new
+        connection instead. Otherwise, if the current stream is still attached
+        after a failed attempt to leave it, nothing changes. If the new one
+        cannot be joined, the plot shows `pol` with no data and no stream.
+
+        :param str pol: the polarimer name
+        :raises RuntimeError: if the WAMP router rejects or does not answer
+         the request, or if the connection cannot be reestablished
+        """
+        if not self.__is_attached():
+            self.__restart(pol)
+            return
+
+        try:
+            self.__switch(pol)
+        except RuntimeError:
+            if self.__is_attached():
+                raise
+            self.__restart(pol)
+
+    def __is_attached(self):
+        return (
+            self.wamp is not None
+            and self.wamp.session is not None
+            and self.wamp.session.is_attached()
+        )
 
-    def set_data(self, pkt):
-        self.wamp.loop.call_soon_threadsafe(self.__set_data, pkt)
+    def __restart(self, pol):
+        """reconnects from scratch, as switching on a lost session is not possible"""
+        conn = self.wamp.conn
+        self.stop()
+        try:
+            self.start(
+                conn, pol, window_sec=self.wsec, items=self.items, refresh=self.rsec
+            )
+        except Exception as e:
+            raise RuntimeError("Cannot reconnect to WAMP: %s" % e) from e
+
+    def __switch(self, pol):
+        if self.sub is not None:
+            try:
+                self.wamp.unsubscribe(self.sub)
+            except RuntimeError:
+                # the handler is detached even if the router did not answer
+                if self.sub.active:
+                    raise
+            self.sub = None
 
-    def append(self, pkt):
-        self.wamp.loop.call_soon_threadsafe(self.__append, pkt)
+        self.pol = pol
+        self.queue.clear()
+        self.__clear_data()
+        self.__replot()
+        self.sub = self.wamp.subscribe_sync(self.__recv, self.conf.get_wamp_pol(pol))
+
+    def replot(self):
+        self.__replot()
 
     def __replot(self):
         self.axes.cla()
         self.axes.set_title(self.pol)
 
         items = deepcopy(self.items)
+        self.lines = []
 
         for t in items:
             for hk in items[t]:
-                if t == "SCI_POL":
-                    (self.data["SCI_POL"][hk]["line"],) = self.axes.plot(
-                        self.data["ts"],
-                        self.data["SCI_POL"][hk]["data"],
-                        label=t + "-" + hk,
-                    )
-                else:
-                    (self.data[t][hk]["line"],) = self.axes.plot(
-                        self.data[t][hk]["ts"],
-                        self.data[t][hk]["data"],
-                        label=t + "-" + hk,
-                    )
+                buf = self.data[t][hk]
+                ts, val = buf.get()
+                (line,) = self.axes.plot(ts, val, label=t + "-" + hk)
+                self.lines.append((line, buf))
 
         self.axes.legend(loc="upper right")
         self.axes.set_xlim([0, self.wsec])
@@ -125,128 +242,85 @@ class PolMplCanvas(MplCanvas):
 
     def __connect(self):
         self.wamp.connect(self.url, self.conf.get_wamp_realm())
+        self.wamp.wait_attached(5)
 
-        s = time.time()
-        while not self.wamp.session.is_attached():
-            if time.time() - s > 5:
-                raise RuntimeError("Cannot attach to WAMP session")
-            time.sleep(0.1)
-
-        self.t0 = time.time()
-        return self.wamp.subscribe(self.__recv, self.conf.get_wamp_pol(self.pol))
+        return self.wamp.subscribe_sync(self.__recv, self.conf.get_wamp_pol(self.pol))
 
     def __recv(self, *args, **pkt):
-        t1 = time.time()
-        self.append(pkt)
+        # runs on the WAMP thread: just hand the packet over to the GUI thread
+        self.queue.append(pkt)
 
-        if t1 - self.t0 > self.rsec:
-            self.t0 = t1
-            self.set_data(pkt)
+    def __refresh(self):
+        """drains the packets received since the last call and redraws the
+        plot. Runs on the GUI thread every `refresh` seconds
+        """
+        mjd = None
+        while self.queue:
+            pkt = self.queue.popleft()
+            # an exception escaping a Qt slot aborts the application: a
+            # malformed packet must only cost that packet
+            try:
+                self.__append(pkt)
+            except Exception:
+                logging.exception("Discarding malformed packet for %s", self.pol)
+                continue
+            mjd = pkt["mjd"]
+
+        # keep buffering, but skip the redraw when nothing is displayed
+        if mjd is not None and self.lines:
+            self.__set_data(mjd)
 
     def __append(self, pkt):
+        pol = pkt.get("pol")
+        if pol is not None and pol.upper() != self.pol.upper():
+            # a late event of a stream this plot has already left
+            return
+
         ts = pkt["mjd"]
-        if self.data["ts"].size == 0 or (ts - self.data["ts"][0]) * 86400 <= self.wsec:
-            if "DEMU1" in pkt.keys():
-                for s in self.data["SCI_POL"].keys():
-                    self.data["SCI_POL"][s]["data"] = np.append(
-                        self.data["SCI_POL"][s]["data"], pkt[s]
-                    )  # TODO do calibration
-
-                self.data["ts"] = np.append(self.data["ts"], ts)
-
-            for hk, val in pkt.get("bias", {}).items():
-                self.data["BIAS_POL"][hk]["data"] = np.append(
-                    self.data["BIAS_POL"][hk]["data"], val
-                )  # TODO do calibration
-                self.data["BIAS_POL"][hk]["ts"] = np.append(
-                    self.data["BIAS_POL"][hk]["ts"], ts
-                )
-            for hk, val in pkt.get("daq", {}).items():
-                self.data["DAQ_POL"][hk]["data"] = np.append(
-                    self.data["DAQ_POL"][hk]["data"], val
-                )  # TODO do calibration
-                self.data["DAQ_POL"][hk]["ts"] = np.append(
-                    self.data["DAQ_POL"][hk]["ts"], ts
-                )
-        else:
-            if "DEMU1" in pkt.keys():
-                for s in self.data["SCI_POL"].keys():
-                    self.data["SCI_POL"][s]["data"][0] = pkt[s]  # TODO do calibration
-                    self.data["SCI_POL"][s]["data"] = np.roll(
-                        self.data["SCI_POL"][s]["data"], -1
-                    )
-
-                self.data["ts"][0] = ts
-                self.data["ts"] = np.roll(self.data["ts"], -1)
-
-            for hk, val in pkt.get("bias", {}).items():
-                self.data["BIAS_POL"][hk]["data"][0] = val  # TODO do calibration
-                self.data["BIAS_POL"][hk]["data"] = np.roll(
-                    self.data["BIAS_POL"][hk]["data"], -1
-                )
-
-                self.data["BIAS_POL"][hk]["ts"][0] = ts
-                self.data["BIAS_POL"][hk]["ts"] = np.roll(
-                    self.data["BIAS_POL"][hk]["ts"], -1
-                )
-
-            for hk, val in pkt.get("daq", {}).items():
-                self.data["DAQ_POL"][hk]["data"][0] = val  # TODO do calibration
-                self.data["DAQ_POL"][hk]["data"] = np.roll(
-                    self.data["DAQ_POL"][hk]["data"], -1
-                )
-
-                self.data["DAQ_POL"][hk]["ts"][0] = ts
-                self.data["DAQ_POL"][hk]["ts"] = np.roll(
-                    self.data["DAQ_POL"][hk]["ts"], -1
-                )
-
-    def __set_data(self, pkt):
-        date_ts = at.Time(pkt["mjd"], format="mjd").to_datetime()
+        if "DEMU1" in pkt:
+            # read every value first, so a missing one leaves no buffer behind
+            vals = [pkt[s] for s, buf in self.sci_buffers]
+            for (s, buf), val in zip(self.sci_buffers, vals):
+                buf.append(ts, val)  # TODO do calibration
+
+        for key, buffers in self.hk_buffers:
+            for hk, val in pkt.get(key, {}).items():
+                buf = buffers.get(hk)
+                if buf is not None:
+                    buf.append(ts, val)  # TODO do calibration
+
+    def __set_data(self, mjd):
         min = np.nan
         max = np.nan
 
-        for t in self.items:
-            for hk in self.items[t]:
-                if t == "SCI_POL":
-                    self.data["SCI_POL"][hk]["line"].set_xdata(
-                        (pkt["mjd"] - self.data["ts"]) * 86400
-                    )
-                    self.data["SCI_POL"][hk]["line"].set_ydata(
-                        self.data["SCI_POL"][hk]["data"]
-                    )
-                    min = np.nanmin([np.min(self.data["SCI_POL"][hk]["data"]), min])
-                    max = np.nanmax([np.max(self.data["SCI_POL"][hk]["data"]), max])
-                else:
-                    if self.data[t][hk]["data"].size > 0:
-                        self.data[t][hk]["line"].set_xdata(
-                            (pkt["mjd"] - self.data[t][hk]["ts"]) * 86400
-                        )
-                        self.data[t][hk]["line"].set_ydata(self.data[t][hk]["data"])
-                        min = np.nanmin([np.min(self.data[t][hk]["data"]), min])
-                        max = np.nanmax([np.max(self.data[t][hk]["data"]), max])
+        for line, buf in self.lines:
+            if len(buf) == 0:
+                continue
+            ts, val = buf.get()
+            line.set_xdata((mjd - ts) * 86400)
+            line.set_ydata(val)
+            min = np.nanmin([np.min(val), min])
+            max = np.nanmax([np.max(val), max])
 
         if not (np.isnan(min) or np.isnan(max)):
             exc = (max - min) / 100 * 2
             self.axes.set_ylim([min - exc, max + exc])
-            self.date.set_text(date_ts.strftime("%H:%M:%S.%f"))
+            date_ts = MJD_EPOCH + dt.timedelta(days=mjd)
+            self.date.set_text(f"{date_ts:%H:%M:%S.%f}")
             self.flush_events()
             self.draw()
 
     def __clear_data(self):
         self.data = {}
-        self.data["SCI_POL"] = {}
-        for s in self.conf.board_addr["SCI_POL"]:
-            self.data["SCI_POL"][s["name"]] = {
-                "data": np.ndarray([0], dtype=np.float64)
-            }
-
-        self.data["ts"] = np.ndarray([0], dtype=np.float64)
-
-        for table in ["BIAS_POL", "DAQ_POL"]:
+        self.lines = []
+        for table in ["SCI_POL", "BIAS_POL", "DAQ_POL"]:
             self.data[table] = {}
             for hk in self.conf.board_addr[table]:
-                self.data[table][hk["name"]] = {
-                    "data": np.ndarray([0], dtype=np.float64),
-                    "ts": np.ndarray([0], dtype=np.float64),
-                }
+                self.data[table][hk["name"]] = SampleBuffer(self.wsec)
+
+        # dispatch tables used by __append, built once instead of per packet
+        self.sci_buffers = tuple(self.data["SCI_POL"].items())
+        self.hk_buffers = (
+            ("bias", self.data["BIAS_POL"]),
+            ("daq", self.data["DAQ_POL"]),
+        )